@@ -13,11 +13,12 @@ from livekit.agents import (
 from livekit.agents import inference
 from livekit.plugins import silero, noise_cancellation, deepgram, groq, hume, openai
 from livekit import rtc
-from typing import Annotated
+from typing import Annotated, Final
 from pydantic import Field
 import logging
 import asyncio
 import json
+import orjson
 import os
 from pathlib import Path
 
@@ -30,37 +31,79 @@ if not load_dotenv():
 if not os.getenv("LIVEKIT_URL") and os.getenv("NEXT_PUBLIC_LIVEKIT_URL"):
     os.environ["LIVEKIT_URL"] = os.getenv("NEXT_PUBLIC_LIVEKIT_URL")
 
+# Keep the VAD's ONNX session to one intra-op thread: with a VAD running per
+# room, per-session thread pools oversubscribe the cores the worker already
+# budgets via load_threshold. Set at import so it precedes any model load in
+# this process; it only applies to OpenMP-enabled onnxruntime builds — the
+# plugin configures the standard wheel's threads via SessionOptions.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("negotiation-agent")
 
+# Constant payloads are serialized once at import; orjson returns bytes
+# directly so there is no per-publish encode step
+_COMPLETE_PAYLOAD = orjson.dumps({"type": "NEGOTIATION_COMPLETE"})
+
+ACCEPT_PROMPT = "You agree with these terms. Accept the offer clearly and politely."
+
+# Persona prompts are static: keeping them as module constants avoids
+# per-job string building and keeps the system prompt byte-identical
+# across jobs, which is what lets the provider's prompt cache hit
+HALIMA_INSTRUCTIONS: Final[str] = """You are Halima, a Kenyan farmer selling bulk maize.
+Goal: Maximize total value.
+Negotiate using: price per kg (target $1.30), delivery inclusion, transport responsibility, and payment timing.
+Strategy: Concede occasionally but not repeatedly on the same dimension.
+Be warm and practical. Explain constraints (fertilizer, labor, cash flow) naturally without repeating the same reason twice.
+If you are starting the negotiation, you must make an initial concrete offer.
+Only call propose_offer when making a concrete counter-offer. You may speak without making an offer.
+If the buyer meets your minimum acceptable terms, you should accept the deal.
+You are expected to vary price over the negotiation. Repeating the same price more than twice without justification is not acceptable."""
+
+ALEX_INSTRUCTIONS: Final[str] = """You are Alex, a professional commodity buyer.
+Goal: Minimize total landed cost and risk.
+Strategy: Evaluate offers holistically. You may accept higher prices if delivery or payment terms improve.
+Be concise and analytical. reject and explain why, or counter with a different bundle.
+Only call propose_offer when making a concrete counter-offer. You may speak without making an offer.
+If an offer meets your target total cost and risk, you should accept it instead of continuing.
+You are expected to vary price over the negotiation. Repeating the same price more than twice without justification is not acceptable."""
+
 # -------------------------------------------------
-STATE = {
-    "rounds": 0,
-    "turns": 0,
-    "max_rounds": 8,
-    "sessions": {},
-    "shutting_down": False,
-    "halima_speaking": False,
-    "accepted_offer": None,
-    "offers": {
-        "halima": None,
-        "alex": None,
-    },
-    "concessions": {
-        "halima": set(),
-        "alex": set(),
-    },
-    "halima_offer_future": None,
-    "alex_offer_future": None,
-}
+# Per-room negotiation state, keyed by room name. A worker can host several
+# concurrent negotiations; a process-global state dict would make them share
+# round counters and overwrite each other's sessions and offers, doubling
+# LLM calls into the wrong session. Entries are dropped on disconnect.
+STATE: dict[str, dict] = {}
+
+def _new_room_state() -> dict:
+    return {
+        "rounds": 0,
+        "turns": 0,
+        "max_rounds": 8,
+        "sessions": {},
+        "shutting_down": False,
+        "halima_speaking": False,
+        "accepted_offer": None,
+        "offers": {
+            "halima": None,
+            "alex": None,
+        },
+        "concessions": {
+            "halima": set(),
+            "alex": set(),
+        },
+        "halima_offer_future": None,
+        "alex_offer_future": None,
+    }
 
 # -------------------------------------------------
 # Agent with Tool
 # -------------------------------------------------
 class NegotiationAgent(Agent):
-    def __init__(self, instructions: str, agent_name: str):
+    def __init__(self, instructions: str, agent_name: str, room_state: dict):
         super().__init__(instructions=instructions)
         self.agent_name = agent_name
+        self.room_state = room_state
         self.room_participant = None  # Assigned after session.start()
 
     @function_tool
@@ -79,32 +122,32 @@ class NegotiationAgent(Agent):
             "delivery_included": delivery_included,
             "transport_paid_by": transport_paid_by,
             "payment_terms": payment_terms,
-            "round": STATE.get("rounds", 0),
+            "round": self.room_state.get("rounds", 0),
         }
 
-        # Track actual concessions (changed fields only) BEFORE overwriting STATE
-        prev = STATE["offers"].get(agent_label.lower())
+        # Track actual concessions (changed fields only) BEFORE overwriting self.room_state
+        prev = self.room_state["offers"].get(agent_label.lower())
         if prev:
             for k in ("price", "delivery_included", "transport_paid_by", "payment_terms"):
                 if prev.get(k) != offer.get(k):
-                    STATE["concessions"][agent_label.lower()].add(k)
+                    self.room_state["concessions"][agent_label.lower()].add(k)
 
-        # Now update STATE
-        STATE["offers"][agent_label.lower()] = offer
+        # Now update self.room_state
+        self.room_state["offers"][agent_label.lower()] = offer
 
-        logger.info(f"📦 [OFFER] {agent_label}: {offer}")
+        logger.info("📦 [OFFER] %s: %s", agent_label, offer)
 
         try:
             await self.room_participant.publish_data(
-                json.dumps({
+                orjson.dumps({
                     "type": "offer_update",
                     "agent": agent_label,
                     "offer": offer,
-                }).encode()
+                })
             )
-            
+
         except Exception as e:
-            logger.error(f"❌ Failed to publish offer: {e}")
+            logger.error("❌ Failed to publish offer: %s", e)
 
 
     async def speak_acceptance(self, offer: dict, role: str):
@@ -136,8 +179,39 @@ class NegotiationAgent(Agent):
 # -------------------------------------------------
 server = AgentServer()
 
+def _enable_eager_tasks():
+    """Start tasks eagerly so short coroutines run inline up to their first
+    real await instead of paying a scheduler round-trip (Python 3.12+)."""
+    factory = getattr(asyncio, "eager_task_factory", None)
+    if factory is None:
+        return
+    try:
+        asyncio.get_event_loop().set_task_factory(factory)
+    except RuntimeError:
+        pass
+
+def _warm_vad(vad):
+    """Run a couple of silent windows through the VAD model so the first real
+    audio frame does not pay the lazy graph/buffer initialization cost."""
+    model = getattr(vad, "_model", None)
+    if model is None:
+        return
+    try:
+        import numpy as np
+        window = np.zeros(getattr(model, "window_size_samples", 512), dtype=np.float32)
+        for _ in range(2):
+            model(window)
+    except Exception:
+        logger.debug("VAD warm-up skipped", exc_info=True)
+
 def prewarm(proc: JobProcess):
-    proc.userdata["vad"] = silero.VAD.load()
+    _enable_eager_tasks()
+    # Loading here means each job process builds its own ONNX session,
+    # which is the safe side of the fork/thread-pool interaction: an
+    # InferenceSession inherited across fork loses its worker threads.
+    vad = silero.VAD.load()
+    _warm_vad(vad)
+    proc.userdata["vad"] = vad
 
 server.setup_fnc = prewarm
 
@@ -148,31 +222,21 @@ server.setup_fnc = prewarm
 async def entrypoint(ctx: JobContext):
     logger.info("Starting dual-agent negotiation")
 
-    # Define instructions for both agents
-    HALIMA_INSTRUCTIONS = """You are Halima, a Kenyan farmer selling bulk maize.
-Goal: Maximize total value.
-Negotiate using: price per kg (target $1.30), delivery inclusion, transport responsibility, and payment timing.
-Strategy: Concede occasionally but not repeatedly on the same dimension. 
-Be warm and practical. Explain constraints (fertilizer, labor, cash flow) naturally without repeating the same reason twice.
-If you are starting the negotiation, you must make an initial concrete offer.
-Only call propose_offer when making a concrete counter-offer. You may speak without making an offer.
-If the buyer meets your minimum acceptable terms, you should accept the deal.
-You are expected to vary price over the negotiation. Repeating the same price more than twice without justification is not acceptable."""
+    await ctx.connect()
 
-    ALEX_INSTRUCTIONS = """You are Alex, a professional commodity buyer.
-Goal: Minimize total landed cost and risk.
-Strategy: Evaluate offers holistically. You may accept higher prices if delivery or payment terms improve.
-Be concise and analytical. reject and explain why, or counter with a different bundle.
-Only call propose_offer when making a concrete counter-offer. You may speak without making an offer.
-If an offer meets your target total cost and risk, you should accept it instead of continuing.
-You are expected to vary price over the negotiation. Repeating the same price more than twice without justification is not acceptable."""
+    room_state = STATE.setdefault(ctx.room.name, _new_room_state())
 
-    await ctx.connect()
+    # Create two separate sessions. STT and LLM clients are stateless, so
+    # one instance (and its connection pool) serves both; only the TTS
+    # differs per persona (voice).
+    shared_stt = deepgram.STT()
+    # Low temperature keeps replies short and on-script, which bounds TTS
+    # time per turn as much as it bounds drift
+    shared_llm = inference.LLM(model="openai/gpt-4o-mini", temperature=0.3)
 
-    # Create two separate sessions
     halima_session = AgentSession(
-        stt=deepgram.STT(),
-        llm=inference.LLM(model="openai/gpt-4o-mini"),
+        stt=shared_stt,
+        llm=shared_llm,
         tts=hume.TTS(
             voice=hume.VoiceByName(name="Kora", provider="HUME_AI"),
             instant_mode=True,
@@ -181,8 +245,8 @@ You are expected to vary price over the negotiation. Repeating the same price mo
     )
 
     alex_session = AgentSession(
-        stt=deepgram.STT(),
-        llm=inference.LLM(model="openai/gpt-4o-mini"),
+        stt=shared_stt,
+        llm=shared_llm,
         tts=hume.TTS(
             voice=hume.VoiceByName(name="Big Dicky", provider="HUME_AI"),
             instant_mode=True,
@@ -193,13 +257,15 @@ You are expected to vary price over the negotiation. Repeating the same price mo
     # Create both agents (room_participant assigned after session start)
     halima_agent = NegotiationAgent(
         instructions=HALIMA_INSTRUCTIONS,
-        agent_name="juma-agent"
+        agent_name="juma-agent",
+        room_state=room_state,
     )
     halima_agent.room_participant = ctx.room.local_participant
 
     alex_agent = NegotiationAgent(
         instructions=ALEX_INSTRUCTIONS,
-        agent_name="alex-agent"
+        agent_name="alex-agent",
+        room_state=room_state,
     )
     alex_agent.room_participant = ctx.room.local_participant
 
@@ -216,10 +282,10 @@ You are expected to vary price over the negotiation. Repeating the same price mo
         room_options=room_io.RoomOptions(close_on_disconnect=False),
     )
 
-    # Store sessions in STATE
-    STATE["sessions"]["halima"] = {"session": halima_session, "agent": halima_agent}
-    STATE["sessions"]["alex"] = {"session": alex_session, "agent": alex_agent}
-    STATE["accepted_offer"] = None
+    # Store sessions in room_state
+    room_state["sessions"]["halima"] = {"session": halima_session, "agent": halima_agent}
+    room_state["sessions"]["alex"] = {"session": alex_session, "agent": alex_agent}
+    room_state["accepted_offer"] = None
     
     logger.info("Both sessions started with correct participant attribution")
 
@@ -228,20 +294,35 @@ You are expected to vary price over the negotiation. Repeating the same price mo
     # -------------------------------------------------
     
     async def publish_timeline():
-        logger.info(f"📊 TIMELINE → round={STATE['rounds']} turn={STATE['turns']}/{STATE['max_rounds']}")
-        payload = json.dumps({
+        logger.info("📊 TIMELINE → round=%d turn=%d/%d", room_state["rounds"], room_state["turns"], room_state["max_rounds"])
+        payload = orjson.dumps({
             "type": "negotiation_timeline",
-            "turn": STATE["turns"],
-            "round": STATE["rounds"],
-            "max_rounds": STATE["max_rounds"]
-        }).encode()
+            "turn": room_state["turns"],
+            "round": room_state["rounds"],
+            "max_rounds": room_state["max_rounds"]
+        })
         await ctx.room.local_participant.publish_data(payload)
 
     async def publish_negotiation_complete():
         logger.info("🏁 Sending NEGOTIATION_COMPLETE signal")
-        await ctx.room.local_participant.publish_data(
-            json.dumps({"type": "NEGOTIATION_COMPLETE"}).encode()
+        await ctx.room.local_participant.publish_data(_COMPLETE_PAYLOAD)
+
+    async def accept_offer(accepter_session, offer, who):
+        """Shared acceptance path for both directions: record the deal, then
+        speak the acceptance while publishing the completion signal."""
+        logger.info("✅ %s accepts the offer", who)
+        room_state["accepted_offer"] = offer
+        results = await asyncio.gather(
+            accepter_session.generate_reply(
+                instructions=ACCEPT_PROMPT,
+                allow_interruptions=False,
+            ),
+            publish_negotiation_complete(),
+            return_exceptions=True,
         )
+        for r in results:
+            if isinstance(r, Exception):
+                logger.error("❌ Acceptance step failed: %s", r)
 
 
     # -------------------------------------------------
@@ -257,26 +338,36 @@ You are expected to vary price over the negotiation. Repeating the same price mo
     async def run_negotiation():
         logger.info("🎮 Negotiation loop started")
         
-        # Wait for room connection
-        while len(ctx.room.remote_participants) < 1:
-            await asyncio.sleep(0.5)
-            logger.info("⏳ Waiting for all participants...")
+        # Wait for the first remote participant, event-driven instead of a
+        # 0.5s poll loop
+        if not ctx.room.remote_participants:
+            joined = asyncio.get_running_loop().create_future()
 
-        await publish_timeline()  # 0/0
-        
-        while STATE["rounds"] < STATE["max_rounds"] and not STATE.get("shutting_down"):
+            def _on_participant(*_args):
+                if not joined.done():
+                    joined.set_result(None)
+
+            ctx.room.on("participant_connected", _on_participant)
+
+            # Re-check after registering in case a join raced the handler
+            if not ctx.room.remote_participants:
+                logger.debug("⏳ Waiting for all participants...")
+                await joined
+
+
+        while room_state["rounds"] < room_state["max_rounds"] and not room_state.get("shutting_down"):
             # ✅ GUARD: Mid-round acceptance check
-            if STATE.get("accepted_offer"):
+            if room_state.get("accepted_offer"):
                 break
 
-            logger.info(f"🏗️ ROUND {STATE['rounds'] + 1}")
+            logger.info("🏗️ ROUND %d", room_state["rounds"] + 1)
 
             # ======================
             # HALIMA'S TURN
             # ======================
             
             # Build Halima's context from structured state
-            last_alex_offer = STATE["offers"]["alex"]
+            last_alex_offer = room_state["offers"]["alex"]
             last_alex_summary = (
                 f"Alex's last offer was {last_alex_offer}"
                 if last_alex_offer
@@ -288,33 +379,33 @@ You are expected to vary price over the negotiation. Repeating the same price mo
             {last_alex_summary}
 
             Current offers:
-            Halima: {STATE['offers']['halima']}
-            Alex: {STATE['offers']['alex']}
+            Halima: {room_state['offers']['halima']}
+            Alex: {room_state['offers']['alex']}
 
-            You are in round {STATE['rounds'] + 1} of {STATE['max_rounds']}.
+            You are in round {room_state['rounds'] + 1} of {room_state['max_rounds']}.
             As rounds progress, push toward closure.
             If this is one of the final 2 rounds, prioritize either reaching agreement or clearly walking away.
             """
 
             # Force price evolution if stale
-            last_halima_offer = STATE["offers"]["halima"]
+            last_halima_offer = room_state["offers"]["halima"]
             if (
                 last_halima_offer and
-                STATE["rounds"] - last_halima_offer["round"] >= 2
+                room_state["rounds"] - last_halima_offer["round"] >= 2
             ):
                 halima_instr += """
                 You have not changed your price recently.
                 You MUST adjust the price in this turn.
                 """
 
-            if STATE["rounds"] == STATE["max_rounds"] - 1:
+            if room_state["rounds"] == room_state["max_rounds"] - 1:
                 halima_instr += """
                 This is the final round.
                 You must either accept, make a final offer, or clearly walk away.
                 Do not hedge or prolong the negotiation.
                 """
 
-            if STATE["rounds"] == 0:
+            if room_state["rounds"] == 0:
                 halima_instr += """
                 You are starting the negotiation.
                 You MUST make an initial concrete offer now.
@@ -328,17 +419,22 @@ You are expected to vary price over the negotiation. Repeating the same price mo
                 """
 
             logger.info("🎤 Halima speaking...")
-            h = await halima_session.generate_reply(
-                instructions=halima_instr,
-                allow_interruptions=False,
+            # The timeline publish is an independent UI notification — run it
+            # concurrently with the LLM call instead of serializing the two
+            h, _ = await asyncio.gather(
+                halima_session.generate_reply(
+                    instructions=halima_instr,
+                    allow_interruptions=False,
+                ),
+                publish_timeline(),
             )
             await h  # ✅ Halima finished speaking + tools
 
             # ✅ ALEX ACCEPTANCE GUARD
-            halima_offer = STATE["offers"]["halima"]
+            halima_offer = room_state["offers"]["halima"]
             if halima_offer:
                 # Early acceptance guard: no deals before meaningful exchange
-                if STATE["rounds"] < 2:
+                if room_state["rounds"] < 2:
                     logger.info("⏳ Alex: Too early to accept, continuing negotiation...")
                 else:
                     price = halima_offer["price"]
@@ -346,35 +442,28 @@ You are expected to vary price over the negotiation. Repeating the same price mo
                     payment = halima_offer["payment_terms"]
 
                     if (
-                        halima_offer["round"] == STATE["rounds"] and
-                        price <= acceptable_price(STATE["rounds"], "buyer") and
+                        halima_offer["round"] == room_state["rounds"] and
+                        price <= acceptable_price(room_state["rounds"], "buyer") and
                         delivery and payment in ("7_days", "14_days")
                     ):
-                        logger.info("✅ Alex accepts Halima's offer")
-                        # Let agent formulate acceptance naturally
-                        await alex_session.generate_reply(
-                            instructions="You agree with these terms. Accept the offer clearly and politely.",
-                            allow_interruptions=False,
-                        )
-                        STATE["accepted_offer"] = halima_offer
-                        await publish_negotiation_complete()
+                        await accept_offer(alex_session, halima_offer, "Alex")
                         break
 
             # ======================
             # ALEX'S TURN
             # ======================
 
-            if STATE.get("shutting_down") or STATE.get("accepted_offer"):
+            if room_state.get("shutting_down") or room_state.get("accepted_offer"):
                 break
 
             logger.info("🎤 Alex speaking...")
             
             alex_instr = f"""
             Halima just proposed this offer:
-            {STATE['offers']['halima']}
+            {room_state['offers']['halima']}
             
             My last offer:
-            {STATE['offers']['alex']}
+            {room_state['offers']['alex']}
 
             Speak naturally to Halima. Do not narrate your actions.
             If accepting, say "That sounds good" and confirm terms.
@@ -382,10 +471,10 @@ You are expected to vary price over the negotiation. Repeating the same price mo
             """
 
             # Force price evolution if stale
-            last_alex_offer = STATE["offers"]["alex"]
+            last_alex_offer = room_state["offers"]["alex"]
             if (
                 last_alex_offer and
-                STATE["rounds"] - last_alex_offer["round"] >= 2
+                room_state["rounds"] - last_alex_offer["round"] >= 2
             ):
                 alex_instr += """
                 You have not changed your price recently.
@@ -399,49 +488,45 @@ You are expected to vary price over the negotiation. Repeating the same price mo
             await a  # ✅ Alex finished speaking + tools
 
             # ✅ HAL IMA ACCEPTANCE GUARD (Halima accepts Alex's offer)
-            alex_offer = STATE["offers"]["alex"]
+            alex_offer = room_state["offers"]["alex"]
 
             if alex_offer:
                 # Early acceptance guard: no deals before meaningful exchange
-                if STATE["rounds"] < 2:
+                if room_state["rounds"] < 2:
                     logger.info("⏳ Halima: Too early to accept, continuing negotiation...")
                 else:
                     price = alex_offer["price"]
                     payment = alex_offer["payment_terms"]
-                    concessions_count = len(STATE["concessions"]["alex"])
+                    concessions_count = len(room_state["concessions"]["alex"])
 
                     # Stricter thresholds: Force price >= dynamic threshold AND multiple concessions
                     if (
-                        alex_offer["round"] == STATE["rounds"] and
-                        price >= acceptable_price(STATE["rounds"], "seller") and
+                        alex_offer["round"] == room_state["rounds"] and
+                        price >= acceptable_price(room_state["rounds"], "seller") and
                         payment in ("7_days", "14_days") and
                         concessions_count > 1
                     ):
-                        logger.info("✅ Halima accepts Alex's offer")
-                        # Let agent formulate acceptance naturally
-                        await halima_session.generate_reply(
-                            instructions="You agree with these terms. Accept the offer clearly and politely.",
-                            allow_interruptions=False,
-                        )
-                        STATE["accepted_offer"] = alex_offer
-                        await publish_negotiation_complete()
+                        await accept_offer(halima_session, alex_offer, "Halima")
                         break
             
             # 3. Advance state logically (each loop = 2 turns: Halima + Alex)
-            STATE["rounds"] += 1
-            STATE["turns"] += 2
+            room_state["rounds"] += 1
+            room_state["turns"] += 2
             
-            logger.info(f"🔄 ROUND {STATE['rounds']} completed. TURN {STATE['turns']}")
-            await publish_timeline()
+            logger.info("🔄 ROUND %d completed. TURN %d", room_state["rounds"], room_state["turns"])
+
+        # Final timeline state for the UI (the per-round publish happens at
+        # the top of each round, overlapped with Halima's reply)
+        await publish_timeline()
 
         # No deal closure message
-        if not STATE["accepted_offer"]:
+        if not room_state["accepted_offer"]:
             await halima_session.generate_reply(
                 instructions="It looks like we couldn't reach an agreement this time. Thank you for the discussion.",
                 allow_interruptions=False,
             )
 
-        logger.info(f"✅ FINAL DEAL: {STATE['accepted_offer']}")
+        logger.info("✅ FINAL DEAL: %s", room_state["accepted_offer"])
         await publish_negotiation_complete()
         logger.info("🏁 Negotiation loop finished")
 
@@ -450,9 +535,22 @@ You are expected to vary price over the negotiation. Repeating the same price mo
     if meta.get("persona") == "Alex":
         asyncio.create_task(run_negotiation())
 
-    # Keep alive
-    while ctx.room.connection_state == rtc.ConnectionState.CONN_CONNECTED:
-        await asyncio.sleep(1)
+    # Keep alive until the room disconnects (event-driven, no polling)
+    done = asyncio.get_running_loop().create_future()
+
+    def _on_disconnected(*_args):
+        room_state["shutting_down"] = True
+        STATE.pop(ctx.room.name, None)
+        if not done.done():
+            done.set_result(None)
+
+    ctx.room.on("disconnected", _on_disconnected)
+
+    # Guard against a disconnect that raced the handler registration
+    if ctx.room.connection_state != rtc.ConnectionState.CONN_CONNECTED and not done.done():
+        done.set_result(None)
+
+    await done
 
 # -------------------------------------------------
 # Run
@@ -460,6 +558,13 @@ You are expected to vary price over the negotiation. Repeating the same price mo
 from livekit.agents import WorkerOptions
 
 if __name__ == "__main__":
+    # The API server already runs on uvloop; give the worker the same
+    # faster event loop when it is available
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
@@ -0,0 +1,19 @@
+"""Shared static tables for the backend API.
+
+Single source of truth for the market price table and the negotiation
+strategy hint strings, so endpoint code imports them instead of keeping
+its own literals.
+"""
+from types import MappingProxyType
+from typing import Mapping
+
+# Read-only so handlers cannot accidentally mutate the shared table
+MARKET_PRICES: Mapping[str, float] = MappingProxyType({
+    "potato": 1.25,
+    "maize": 0.85,
+    "tomatoes": 2.10,
+})
+
+HINT_DEFAULT = "[ Alex sounds controlled. Hold your price. ]"
+HINT_STRESS = "[ Detect high stress in Buyer. Use Mirroring and Tactical Silence. ]"
+HINT_URGENCY = "[ Buyer is hurried. Hold the anchor at $1.25. They need to move. ]"
@@ -1,26 +1,86 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+import asyncio
+import functools
+import httpx
+import orjson
+import jwt
 import os
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from pathlib import Path
 from livekit import api
 from livekit.api import CreateAgentDispatchRequest
+from constants import MARKET_PRICES, HINT_DEFAULT, HINT_STRESS, HINT_URGENCY
 
 
-if not load_dotenv():
-    # If that fails or file missing, try parent dir
-    env_path = Path(__file__).parent.parent / ".env"
-    load_dotenv(dotenv_path=env_path)
+@functools.lru_cache(maxsize=1)
+def _load_env_once():
+    """Parse .env a single time per process; worker spawns and hot reloads
+    that re-import this module skip the repeat filesystem walk."""
+    if not load_dotenv(override=False):
+        # If that fails or file missing, try parent dir
+        env_path = Path(__file__).resolve().parent.parent / ".env"
+        load_dotenv(dotenv_path=env_path, override=False)
 
-if not os.getenv("LIVEKIT_URL") and os.getenv("NEXT_PUBLIC_LIVEKIT_URL"):
-    os.environ["LIVEKIT_URL"] = os.getenv("NEXT_PUBLIC_LIVEKIT_URL")
+    if not os.getenv("LIVEKIT_URL") and os.getenv("NEXT_PUBLIC_LIVEKIT_URL"):
+        os.environ["LIVEKIT_URL"] = os.getenv("NEXT_PUBLIC_LIVEKIT_URL")
 
-app = FastAPI(title="Harvest Backend")
+_load_env_once()
 
-# Add CORS Middleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients once per worker so request handlers reuse the
+    connection pool instead of paying a fresh TLS handshake per call."""
+    api_key = os.getenv("LIVEKIT_API_KEY")
+    api_secret = os.getenv("LIVEKIT_API_SECRET")
+    lk_url = os.getenv("LIVEKIT_URL")
+    app.state.lk_api = (
+        api.LiveKitAPI(lk_url, api_key, api_secret)
+        if api_key and api_secret and lk_url
+        else None
+    )
+    app.state.http = httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+    # Bind credentials once per worker; handlers read these instead of
+    # hitting the environment on every request
+    app.state.lk_creds = (api_key, api_secret) if api_key and api_secret else None
+    hume_key = os.getenv("HUME_API_KEY")
+    hume_secret = os.getenv("HUME_API_SECRET")
+    app.state.hume_creds = (hume_key, hume_secret) if hume_key and hume_secret else None
+    # Surface missing configuration once at startup rather than on the
+    # first failing request
+    if app.state.lk_api is None:
+        print("WARNING: LiveKit credentials not configured — token and dispatch endpoints will return errors")
+    if app.state.hume_creds is None:
+        print("WARNING: Hume credentials not configured — /hume/token will return errors")
+    yield
+    await app.state.http.aclose()
+    if app.state.lk_api is not None:
+        await app.state.lk_api.aclose()
+
+app = FastAPI(
+    title="Harvest Backend",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+# Add CORS Middleware. Origins come from ALLOWED_ORIGINS (comma-separated)
+# so production can pin the frontend host without a code change; defaults
+# to the local dev frontend.
+_allowed_origins = [
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
+    if origin.strip()
+]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], # In production, replace with specific origins
+    allow_origins=_allowed_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -30,44 +90,81 @@ app.add_middleware(
 async def root():
     return {"message": "Harvest Backend API is running"}
 
+# Hume access tokens are valid for a while, so cache them per credential
+# pair and only hit the OAuth endpoint when the cached one is near expiry.
+# The lock makes a cold cache single-flight: concurrent requests wait for
+# one fetch instead of each hitting the OAuth endpoint.
+_hume_token_cache: dict[tuple[str, str], tuple[str, float]] = {}
+_hume_token_lock = asyncio.Lock()
+
 @app.get("/hume/token")
-async def get_hume_token():
+async def get_hume_token(request: Request):
     """
     Fetches a Hume access token using the API key and Secret.
     """
-    import requests
-    from requests.auth import HTTPBasicAuth
-    
-    api_key = os.getenv("HUME_API_KEY")
-    api_secret = os.getenv("HUME_API_SECRET")
-
-    if not api_key or not api_secret:
+    creds = request.app.state.hume_creds
+    if creds is None:
         raise HTTPException(status_code=500, detail="Hume credentials not configured")
+    api_key, api_secret = creds
 
-    try:
-        res = requests.post(
-            "https://api.hume.ai/oauth2-cc/token",
-            auth=HTTPBasicAuth(api_key, api_secret),
-            data={"grant_type": "client_credentials"},
-            timeout=10
-        )
-        res.raise_for_status()
-        data = res.json()
-        return {"accessToken": data["access_token"]}
-    except Exception as e:
-        print(f"Hume Token Fetch Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to fetch Hume access token: {str(e)}")
+    cached = _hume_token_cache.get(creds)
+    if cached is not None and time.monotonic() < cached[1]:
+        return {"accessToken": cached[0]}
+
+    async with _hume_token_lock:
+        # Re-check: another request may have refreshed the token while we
+        # waited for the lock
+        cached = _hume_token_cache.get(creds)
+        if cached is not None and time.monotonic() < cached[1]:
+            return {"accessToken": cached[0]}
+
+        try:
+            res = await request.app.state.http.post(
+                "https://api.hume.ai/oauth2-cc/token",
+                auth=(api_key, api_secret),
+                data={"grant_type": "client_credentials"},
+            )
+            res.raise_for_status()
+            data = res.json()
+            token = data["access_token"]
+            # Refresh 60s before the reported expiry to avoid handing out a
+            # token that dies mid-session
+            expires_in = data.get("expires_in", 1800)
+            _hume_token_cache[creds] = (token, time.monotonic() + expires_in - 60)
+            return {"accessToken": token}
+        except Exception as e:
+            print(f"Hume Token Fetch Error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to fetch Hume access token: {str(e)}")
+
+# Token minting involves an HMAC signature; cache per (participant, room)
+# for a window well inside the token's validity so repeated fetches from
+# the same client (reconnects, refreshes) reuse the signed JWT. The
+# frontend mints a random participant name per connect, so entries are
+# often one-shot: expired keys are swept on insert and the dict is
+# capped so it cannot grow for the life of the process.
+_LK_TOKEN_TTL = 300.0
+_LK_TOKEN_CACHE_MAX = 256
+
+# Dispatch metadata is identical across the token, debug and dispatch
+# endpoints — serialize each role's payload once at import time
+_SELLER_METADATA = orjson.dumps({"role": "seller", "persona": "Juma"}).decode()
+_BUYER_METADATA = orjson.dumps({"role": "buyer", "persona": "Alex"}).decode()
+_lk_token_cache: dict[tuple[str, str], tuple[str, float]] = {}
 
 @app.get("/livekit/token")
-async def get_livekit_token(participant_name: str, room_name: str = "BARN_ROOM_01"):
+async def get_livekit_token(request: Request, participant_name: str, room_name: str = "BARN_ROOM_01"):
     """
     Generates a LiveKit access token for a participant.
     """
-    api_key = os.getenv("LIVEKIT_API_KEY")
-    api_secret = os.getenv("LIVEKIT_API_SECRET")
-    
-    if not api_key or not api_secret:
+    creds = request.app.state.lk_creds
+    if creds is None:
         raise HTTPException(status_code=500, detail="LiveKit credentials not configured")
+    api_key, api_secret = creds
+
+    cache_key = (participant_name, room_name)
+    cached = _lk_token_cache.get(cache_key)
+    if cached is not None and time.monotonic() < cached[1]:
+        return {"token": cached[0]}
 
     token = api.AccessToken(api_key, api_secret) \
         .with_identity(participant_name) \
@@ -80,26 +177,35 @@ async def get_livekit_token(participant_name: str, room_name: str = "BARN_ROOM_0
             agents=[
                 api.RoomAgentDispatch(
                     agent_name="negotiation-worker",
-                    metadata='{"role": "seller", "persona": "Juma"}'
+                    metadata=_SELLER_METADATA
                 ),
                 api.RoomAgentDispatch(
                     agent_name="negotiation-worker",
-                    metadata='{"role": "buyer", "persona": "Alex"}'
+                    metadata=_BUYER_METADATA
                 )
             ]
         ))
 
-    return {"token": token.to_jwt()}
+    jwt_token = token.to_jwt()
+    now = time.monotonic()
+    for key in [k for k, v in _lk_token_cache.items() if v[1] <= now]:
+        del _lk_token_cache[key]
+    while len(_lk_token_cache) >= _LK_TOKEN_CACHE_MAX:
+        # Dicts iterate in insertion order, so this drops the oldest entry
+        del _lk_token_cache[next(iter(_lk_token_cache))]
+    _lk_token_cache[cache_key] = (jwt_token, now + _LK_TOKEN_TTL)
+    return {"token": jwt_token}
 
 @app.get("/debug/token")
-async def debug_token(participant_name: str, room_name: str = "BARN_ROOM_01"):
+async def debug_token(request: Request, participant_name: str, room_name: str = "BARN_ROOM_01"):
     """
     Returns the decoded token claims to verify dispatch rules.
     """
-    import jwt
-    api_key = os.getenv("LIVEKIT_API_KEY")
-    api_secret = os.getenv("LIVEKIT_API_SECRET")
-    
+    creds = request.app.state.lk_creds
+    if creds is None:
+        raise HTTPException(status_code=500, detail="LiveKit credentials not configured")
+    api_key, api_secret = creds
+
     token = api.AccessToken(api_key, api_secret) \
         .with_identity(participant_name) \
         .with_name(participant_name) \
@@ -111,11 +217,11 @@ async def debug_token(participant_name: str, room_name: str = "BARN_ROOM_01"):
             agents=[
                 api.RoomAgentDispatch(
                     agent_name="negotiation-worker",
-                    metadata='{"role": "seller", "persona": "Juma"}'
+                    metadata=_SELLER_METADATA
                 ),
                 api.RoomAgentDispatch(
                     agent_name="negotiation-worker",
-                    metadata='{"role": "buyer", "persona": "Alex"}'
+                    metadata=_BUYER_METADATA
                 )
             ]
         ))
@@ -124,42 +230,63 @@ async def debug_token(participant_name: str, room_name: str = "BARN_ROOM_01"):
     decoded = jwt.decode(jwt_token, options={"verify_signature": False})
     return {"claims": decoded}
 
+# Rooms with a dispatch currently in flight. The membership check and add
+# happen with no await in between, so on a single event loop concurrent
+# requests for the same room cannot both pass the guard and double-dispatch
+# the agents.
+_dispatching: set = set()
+
 @app.post("/livekit/dispatch")
-async def dispatch_agents(room_name: str = "BARN_ROOM_01"):
-    api_key = os.getenv("LIVEKIT_API_KEY")
-    api_secret = os.getenv("LIVEKIT_API_SECRET")
-    lk_url = os.getenv("LIVEKIT_URL")
+async def dispatch_agents(request: Request, room_name: str = "BARN_ROOM_01"):
+    client = request.app.state.lk_api
+    if client is None:
+        raise HTTPException(status_code=503, detail="LiveKit credentials not configured")
 
-    if not api_key or not api_secret or not lk_url:
-        raise HTTPException(status_code=500, detail="LiveKit credentials not configured")
+    if room_name in _dispatching:
+        return {"status": "already_dispatching", "agents": []}
+    _dispatching.add(room_name)
 
-    client = api.LiveKitAPI(lk_url, api_key, api_secret)
+    seller_req = CreateAgentDispatchRequest(
+        room=room_name,
+        agent_name="negotiation-worker",
+        metadata=_SELLER_METADATA,
+    )
+    buyer_req = CreateAgentDispatchRequest(
+        room=room_name,
+        agent_name="negotiation-worker",
+        metadata=_BUYER_METADATA,
+    )
 
     try:
-        # Dispatch Halima
-        await client.agent_dispatch.create_dispatch(
-            CreateAgentDispatchRequest(
-                room=room_name,
-                agent_name="negotiation-worker",
-                metadata='{"role": "seller", "persona": "Juma"}',
-            )
+        # The two dispatches are independent — run them concurrently so the
+        # call start pays one round trip instead of two. return_exceptions
+        # keeps one failure from cancelling the other dispatch mid-flight.
+        results = await asyncio.gather(
+            client.agent_dispatch.create_dispatch(seller_req),
+            client.agent_dispatch.create_dispatch(buyer_req),
+            return_exceptions=True,
         )
+        errors = [str(r) for r in results if isinstance(r, Exception)]
+        if errors:
+            raise HTTPException(status_code=500, detail="; ".join(errors))
 
-        # Dispatch Alex
-        await client.agent_dispatch.create_dispatch(
-            CreateAgentDispatchRequest(
-                room=room_name,
-                agent_name="negotiation-worker",
-                metadata='{"role": "buyer", "persona": "Alex"}',
-            )
-        )
-
-        await client.aclose()
         return {"status": "dispatched", "agents": ["halima-agent", "alex-agent"]}
 
-    except Exception as e:
-        await client.aclose()
-        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        _dispatching.discard(room_name)
+
+# Price table is static, so the full response per crop is built once at
+# import time and the handler is a single dict lookup
+_PRICE_RESPONSES = {
+    crop: orjson.dumps({
+        "crop": crop,
+        "price": price,
+        "unit": "kg",
+        "currency": "USD",
+        "market_trend": "Rising" if price > 1.0 else "Stable"
+    })
+    for crop, price in MARKET_PRICES.items()
+}
 
 @app.get("/market-price/{crop}")
 async def get_market_price(crop: str):
@@ -167,22 +294,16 @@ async def get_market_price(crop: str):
     Standard market price lookup.
     Used by Hume Agent Tools to stay grounded in real data.
     """
-    prices = {
-        "potato": 1.25,
-        "maize": 0.85,
-        "tomatoes": 2.10
-    }
-    price = prices.get(crop.lower())
-    if price is None:
+    payload = _PRICE_RESPONSES.get(crop.lower())
+    if payload is None:
         raise HTTPException(status_code=404, detail="Crop price not found")
-    
-    return {
-        "crop": crop, 
-        "price": price, 
-        "unit": "kg", 
-        "currency": "USD",
-        "market_trend": "Rising" if price > 1.0 else "Stable"
-    }
+    return Response(content=payload, media_type="application/json")
+
+# The three possible hints are fixed strings; build each response dict
+# once so the handler only selects between them
+_HINT_DEFAULT = {"hint": HINT_DEFAULT}
+_HINT_STRESS = {"hint": HINT_STRESS}
+_HINT_URGENCY = {"hint": HINT_URGENCY}
 
 @app.post("/negotiation/strategy")
 async def get_strategy_hint(buyer_stress: float, buyer_urgency: float):
@@ -190,15 +311,24 @@ async def get_strategy_hint(buyer_stress: float, buyer_urgency: float):
     Tactical Empathy Orchestrator.
     Determines if Halima should hold firm, flinch, or use silence.
     """
-    hint = "[ Alex sounds controlled. Hold your price. ]"
-    
     if buyer_stress > 0.7:
-        hint = "[ Detect high stress in Buyer. Use Mirroring and Tactical Silence. ]"
-    elif buyer_urgency > 0.8:
-        hint = "[ Buyer is hurried. Hold the anchor at $1.25. They need to move. ]"
-        
-    return {"hint": hint}
+        return _HINT_STRESS
+    if buyer_urgency > 0.8:
+        return _HINT_URGENCY
+    return _HINT_DEFAULT
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop + httptools: faster event loop and HTTP parser for handlers
+    # that are almost entirely await-bound on outbound calls. Multiple
+    # workers need the import-string form so each process builds its own
+    # app (and its own lifespan clients).
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+    )